@@ -1,8 +1,15 @@
 import smartsheet
 import pandas as pd
 from dateutil.parser import parse as parse_date
-from datetime import datetime, timedelta
-import pytz
+from datetime import date, datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from smartsheet.exceptions import ApiError
+import argparse
+import functools
+import orjson
+import os
+import pickle
+import time
 
 # ---- CONFIG ----
 API_TOKEN = 'YOUR_SMARTSHEET_API_TOKEN_HERE'  # <-- INSERT YOUR API TOKEN
@@ -10,9 +17,24 @@ REFERENCE_SHEET_ID = 3239244454645636         # Source structure sheet
 ARCHIVE_SHEET_ID = 7514584211476356           # Archive Master Sheet
 HELPER_SHEET_ID = 2383431225790340            # Optional: Staging/Helper Sheet
 
+# Optional: only consider sheets whose name starts with this prefix ('' = all sheets)
+SOURCE_SHEET_PREFIX = ''
+
 # Set to True for testing (won't modify data), False for production
 DRY_RUN = False
 
+# Number of concurrent Smartsheet requests when reading sheets
+MAX_WORKERS = 8
+
+# Seconds to wait between retries when the API rate limits us
+RETRY_DELAYS = [1, 2, 4]
+
+# Local cache of archive keys, reused while the archive sheet version is unchanged
+ARCHIVE_CACHE_FILE = '.cache/archive_keys.pkl'
+
+# Rows per add_rows request when appending to the archive
+ADD_ROWS_CHUNK_SIZE = 300
+
 # Main mapping: {destination_col: source_col}
 COLUMN_MAP = {
     'PROMAX': 'Units Total Price',
@@ -32,11 +54,25 @@ COLUMN_MAP = {
 }
 
 # ---- HELPER FUNCTIONS ----
+def with_retry(func, *args, **kwargs):
+    """Calls a Smartsheet API function, backing off and retrying when rate limited."""
+    for delay in RETRY_DELAYS + [None]:
+        try:
+            return func(*args, **kwargs)
+        except ApiError as e:
+            result = getattr(e.error, 'result', None)
+            rate_limited = result is not None and (result.status_code == 429 or result.code == 4004)
+            if not rate_limited or delay is None:
+                raise
+            print(f"    ⚠️  Rate limited, retrying in {delay}s...")
+            time.sleep(delay)
+
 def get_matching_sheets(ss_client, reference_sheet_id):
     """Finds all sheets that have the same columns as the reference structure."""
     print(f"  Getting reference sheet structure from ID: {reference_sheet_id}")
-    ref_sheet = ss_client.Sheets.get_sheet(reference_sheet_id)
-    ref_col_set = set([col.title for col in ref_sheet.columns])
+    # Only column titles are needed, so fetch the schema without any row data
+    ref_cols = with_retry(ss_client.Sheets.get_columns, reference_sheet_id, include_all=True).data
+    ref_col_set = set([col.title for col in ref_cols])
     print(f"  Reference columns: {sorted(ref_col_set)}")
     
     # Updated to use new pagination API instead of deprecated include_all=True
@@ -61,27 +97,43 @@ def get_matching_sheets(ss_client, reference_sheet_id):
     
     print(f"  Found {len(all_sheets)} total sheets in workspace")
     
+    # Never treat the reference, archive or helper sheets as data sources
+    excluded_ids = {reference_sheet_id, REFERENCE_SHEET_ID, ARCHIVE_SHEET_ID, HELPER_SHEET_ID}
+    candidate_sheets = [s for s in all_sheets
+                        if s.id not in excluded_ids and s.name.startswith(SOURCE_SHEET_PREFIX)]
+    print(f"  Checking {len(candidate_sheets)} candidate sheets")
+    
     matching_sheets = []
-    for s in all_sheets:
-        try:
-            this_sheet = ss_client.Sheets.get_sheet(s.id)
-            this_col_set = set([col.title for col in this_sheet.columns])
-            # At least all required columns exist (may have extras)
-            if ref_col_set.issubset(this_col_set):
-                matching_sheets.append({'id': s.id, 'name': s.name})
-                print(f"    ✓ MATCH: {s.name} (ID: {s.id})")
-            else:
-                missing_cols = ref_col_set - this_col_set
-                print(f"    ✗ SKIP: {s.name} - Missing columns: {missing_cols}")
-        except Exception as e:
-            print(f"    ✗ ERROR accessing {s.name}: {e}")
-            continue
+    # Sheet reads are network-bound, so fetch them concurrently, but handle the
+    # results in list order so the match list doesn't depend on network timing
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(with_retry, ss_client.Sheets.get_columns, s.id, include_all=True): s for s in candidate_sheets}
+        for future, s in futures.items():
+            try:
+                cols = future.result().data
+                this_col_set = set([col.title for col in cols])
+                # At least all required columns exist (may have extras)
+                if ref_col_set.issubset(this_col_set):
+                    # Keep the column ids so the data pull can request only the columns it needs
+                    column_ids = {col.title: col.id for col in cols}
+                    matching_sheets.append({'id': s.id, 'name': s.name, 'column_ids': column_ids})
+                    print(f"    ✓ MATCH: {s.name} (ID: {s.id})")
+                else:
+                    missing_cols = ref_col_set - this_col_set
+                    print(f"    ✗ SKIP: {s.name} - Missing columns: {missing_cols}")
+            except Exception as e:
+                print(f"    ✗ ERROR accessing {s.name}: {e}")
+                continue
     return matching_sheets
 
-def get_sheet_data(ss_client, sheet_id, sheet_name="Unknown"):
-    """Pulls all rows from a Smartsheet, returns as list of dicts keyed by column name."""
+def get_sheet_data(ss_client, sheet_id, sheet_name="Unknown", column_ids=None, required_col=None):
+    """Pulls rows from a Smartsheet, returns as list of dicts keyed by column name.
+
+    If column_ids is given, only those columns are fetched. Rows with no value
+    in required_col are skipped.
+    """
     print(f"  Reading data from {sheet_name} (ID: {sheet_id})")
-    sheet = ss_client.Sheets.get_sheet(sheet_id)
+    sheet = with_retry(ss_client.Sheets.get_sheet, sheet_id, column_ids=column_ids)
     col_map = {col.id: col.title for col in sheet.columns}
     data = []
     for row in sheet.rows:
@@ -90,16 +142,57 @@ def get_sheet_data(ss_client, sheet_id, sheet_name="Unknown"):
             col_name = col_map.get(cell.column_id, None)
             if col_name:
                 row_dict[col_name] = cell.value
+        if required_col and row_dict.get(required_col) is None:
+            continue
         data.append(row_dict)
-    print(f"    Found {len(data)} total rows")
+    print(f"    Found {len(sheet.rows)} total rows, {len(data)} kept")
     return data
 
-def get_archive_existing_keys(ss_client, archive_sheet_id, unique_key_cols):
-    """Get all existing archive records as a set of tuples for uniqueness checking."""
+def load_archive_key_cache(archive_sheet_id, version, key_cols):
+    """Returns cached archive keys if they were saved for this sheet version and key columns, else None."""
+    try:
+        with open(ARCHIVE_CACHE_FILE, 'rb') as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"    WARNING: Could not read archive key cache: {e}")
+        return None
+    if (cache.get('sheet_id'), cache.get('version'), cache.get('key_cols')) != (archive_sheet_id, version, key_cols):
+        return None
+    return cache.get('keys')
+
+def save_archive_key_cache(archive_sheet_id, version, key_cols, keys):
+    """Saves archive keys along with the sheet version they were read from."""
+    try:
+        os.makedirs(os.path.dirname(ARCHIVE_CACHE_FILE) or '.', exist_ok=True)
+        with open(ARCHIVE_CACHE_FILE, 'wb') as f:
+            pickle.dump({'sheet_id': archive_sheet_id, 'version': version,
+                         'key_cols': key_cols, 'keys': keys}, f)
+    except Exception as e:
+        print(f"    WARNING: Could not write archive key cache: {e}")
+
+def clear_archive_key_cache():
+    """Removes the archive key cache so the next run re-reads the archive sheet."""
+    try:
+        os.remove(ARCHIVE_CACHE_FILE)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"    WARNING: Could not remove archive key cache: {e}")
+
+def get_archive_existing_keys(ss_client, archive_sheet_id, unique_key_cols, refresh_cache=False):
+    """Get all existing archive record keys as a pandas MultiIndex for uniqueness checking.
+
+    Also returns the archive column title -> id map so callers can reuse it, and the
+    sheet version the keys correspond to (None if the archive couldn't be read). Keys are
+    cached locally and reused while the archive sheet version is unchanged, unless
+    refresh_cache is set.
+    """
     print(f"  Reading existing archive records from ID: {archive_sheet_id}")
     try:
-        sheet = ss_client.Sheets.get_sheet(archive_sheet_id)
-        col_map = {col.title: col.id for col in sheet.columns}
+        archive_cols = with_retry(ss_client.Sheets.get_columns, archive_sheet_id, include_all=True).data
+        col_map = {col.title: col.id for col in archive_cols}
         
         # First, let's see what columns actually exist in the archive sheet
         print(f"    Archive sheet columns: {sorted(col_map.keys())}")
@@ -128,58 +221,104 @@ def get_archive_existing_keys(ss_client, archive_sheet_id, unique_key_cols):
         effective_key_cols = available_cols if available_cols else unique_key_cols
         print(f"    Using columns for duplicate detection: {effective_key_cols}")
         
-        keys = set()
+        # Skip the row scan entirely if the archive hasn't changed since the keys were cached
+        version = with_retry(ss_client.Sheets.get_sheet_version, archive_sheet_id).version
+        if refresh_cache:
+            print(f"    Refreshing archive key cache")
+        else:
+            cached_keys = load_archive_key_cache(archive_sheet_id, version, effective_key_cols)
+            if cached_keys is not None:
+                print(f"    Archive unchanged (version {version}), using {len(cached_keys)} cached keys")
+                return cached_keys, effective_key_cols, col_map, version
+        
+        # Only pull the key columns from the archive rather than every cell
+        key_col_ids = [col_map[archive_col_mapping.get(col, col)] for col in effective_key_cols
+                       if archive_col_mapping.get(col, col) in col_map]
+        sheet = with_retry(ss_client.Sheets.get_sheet, archive_sheet_id, column_ids=key_col_ids or None)
+        
+        # Column id for each key column (None if the archive doesn't have it)
+        key_lookup_ids = [col_map.get(archive_col_mapping.get(col, col)) for col in effective_key_cols]
+        
+        # Collect key values column-wise rather than as a set of per-row tuples
+        key_arrays = [[] for _ in key_lookup_ids]
         for row in sheet.rows:
             try:
-                key_values = []
-                for col in effective_key_cols:
-                    archive_col_name = archive_col_mapping.get(col, col)
-                    if archive_col_name in col_map:
-                        value = row.get_column(col_map[archive_col_name]).value
-                    else:
-                        value = None
-                    key_values.append(value)
-                key = tuple(key_values)
-                keys.add(key)
+                # Index the row's cells once instead of scanning them per key column
+                cell_by_col = {cell.column_id: cell.value for cell in row.cells}
+                key = [cell_by_col.get(col_id) for col_id in key_lookup_ids]
             except Exception as e:
                 print(f"    WARNING: Error processing archive row: {e}")
                 continue
+            for values, value in zip(key_arrays, key):
+                values.append(value)
         
+        # A MultiIndex stores keys as small integer codes into per-column levels, which is far
+        # more compact than Python tuples, and lets Step 4 probe all consolidated keys in one call
+        keys = pd.MultiIndex.from_arrays(key_arrays, names=effective_key_cols).unique()
         print(f"    Found {len(keys)} existing archive records")
-        return keys, effective_key_cols
+        save_archive_key_cache(archive_sheet_id, version, effective_key_cols, keys)
+        return keys, effective_key_cols, col_map, version
     except Exception as e:
         print(f"    ERROR: Could not read archive sheet: {e}")
-        return set(), unique_key_cols
+        return pd.MultiIndex.from_tuples([], names=unique_key_cols), unique_key_cols, {}, None
+
+@functools.lru_cache(maxsize=4096)
+def parse_date_fast(date_str):
+    """Parses a date string, trying the fast ISO 8601 parser before dateutil. Results are cached."""
+    try:
+        return datetime.fromisoformat(date_str[:19])
+    except ValueError:
+        return parse_date(date_str)
 
 def week_start(date_obj):
     """Returns the most recent Sunday before or on the given date (week starts Sunday)."""
     # FIXED: Corrected week start calculation
-    if not isinstance(date_obj, datetime):
-        date_obj = parse_date(str(date_obj))
+    # Strings go straight to the cached parser; dates and datetimes are used as-is
+    if isinstance(date_obj, str):
+        date_obj = parse_date_fast(date_obj)
+    elif not isinstance(date_obj, date):
+        date_obj = parse_date_fast(str(date_obj))
     
-    # Python weekday(): Monday=0, Sunday=6
-    # We want to go back to the most recent Sunday
-    days_since_sunday = (date_obj.weekday() + 1) % 7
-    return date_obj - timedelta(days=days_since_sunday)
+    # Proleptic ordinal 1 (0001-01-01) is a Monday, so ordinal % 7 is the
+    # number of days since the most recent Sunday
+    ordinal = date_obj.toordinal()
+    return datetime.fromordinal(ordinal - ordinal % 7)
 
-def is_past_week(date_str):
-    """Checks if a date string is before the start of the current week."""
+def is_past_week(date_str, current_week_start):
+    """Checks if a date string is before the start of the current week (as returned by week_start)."""
     if not date_str:
         return False
-    today = datetime.now()
     try:
-        date_val = parse_date(str(date_str))
+        date_val = parse_date_fast(str(date_str))
     except Exception:
         return False
-    # Start of current week (Sunday)
-    current_week_start = week_start(today)
     return date_val < current_week_start
 
+def parse_date_column(values):
+    """Parses a Series of date values into naive datetimes (UTC for zoned values); NaT if unparseable."""
+    parsed = pd.to_datetime(values, errors='coerce', format='ISO8601', utc=True).dt.tz_localize(None)
+    
+    # Anything the vectorized ISO 8601 parser rejected goes through dateutil, as before
+    retry = parsed.isna() & values.notna() & (values != '')
+    if retry.any():
+        def parse_one(value):
+            try:
+                value = parse_date_fast(str(value))
+            except (ValueError, OverflowError):
+                return None
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            return value
+        parsed[retry] = pd.to_datetime(values[retry].map(parse_one))
+    return parsed
+
 # ---- MAIN WORKFLOW ----
-def main():
+def main(refresh_cache=False):
     print("=== UPR REPORT MAPPING TOOL ===")
     print(f"DRY_RUN: {DRY_RUN}")
-    print(f"Current time: {datetime.now()}")
+    # Read the clock once so every step uses the same week boundary
+    run_time = datetime.now()
+    print(f"Current time: {run_time}")
     
     if API_TOKEN == 'YOUR_SMARTSHEET_API_TOKEN_HERE':
         print("\n❌ ERROR: Please set your API_TOKEN before running!")
@@ -187,6 +326,8 @@ def main():
     
     try:
         ss_client = smartsheet.Smartsheet(API_TOKEN)
+        # Raise ApiError on failures so rate limits can be retried
+        ss_client.errors_as_exceptions(True)
         print(f"\n✓ Connected to Smartsheet API")
     except Exception as e:
         print(f"\n❌ ERROR: Could not connect to Smartsheet: {e}")
@@ -203,75 +344,102 @@ def main():
         print(f"❌ ERROR in sheet discovery: {e}")
         return
 
+    # 1.5 Load existing archive keys up front so Step 2 can drop rows that are already archived
+    print('\n=== STEP 1.5: LOADING EXISTING ARCHIVE KEYS ===')
+    unique_key_cols = ['Job Number', 'Foreman', 'Work Release']
+    archive_index, effective_key_cols, archive_col_map, archive_version = get_archive_existing_keys(
+        ss_client, ARCHIVE_SHEET_ID, unique_key_cols, refresh_cache=refresh_cache)
+    # No version means the archive couldn't be read, so the key index is incomplete
+    archive_keys_loaded = archive_version is not None
+
     # 2. Pull and consolidate data from all source sheets
     print('\n=== STEP 2: PULLING AND FILTERING DATA ===')
-    records = []
+    frames = []
     total_rows_processed = 0
     rows_with_promax = 0
     rows_with_past_dates = 0
     rows_meeting_criteria = 0
+    rows_already_archived = 0
+    rows_with_bad_dates = 0
     
-    for sheet in matching_sheets:
-        try:
-            rows = get_sheet_data(ss_client, sheet['id'], sheet['name'])
-            total_rows_processed += len(rows)
-            
-            sheet_records = 0
-            for row in rows:
+    # Rows must be logged before the start of the current week (Sunday)
+    current_week_start = week_start(run_time)
+    source_cols = [src_col for src_col in COLUMN_MAP.values() if src_col]
+    dest_by_source = {src_col: dest_col for dest_col, src_col in COLUMN_MAP.items() if src_col}
+    
+    # Pull source sheets concurrently, but filter them in submission order so the row
+    # order (and which record wins a tie in Step 3) is the same on every run
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {}
+        for sheet in matching_sheets:
+            # Only request the mapped source columns, and drop rows without a PROMAX value
+            column_ids = [sheet['column_ids'][col] for col in source_cols if col in sheet['column_ids']]
+            future = executor.submit(get_sheet_data, ss_client, sheet['id'], sheet['name'],
+                                     column_ids, COLUMN_MAP['PROMAX'])
+            futures[future] = sheet
+        for future, sheet in futures.items():
+            try:
+                rows = future.result()
+                total_rows_processed += len(rows)
+                if not rows:
+                    print(f"    {sheet['name']}: 0 records meeting criteria")
+                    continue
+                
                 # Only pull rows with Units Total Price (PROMAX) > 0 and a valid Week Ending date in past
-                promax_val = row.get(COLUMN_MAP['PROMAX'], None)
-                week_ending = row.get(COLUMN_MAP['Weekly Reference Logged Date'], None)
+                df_sheet = pd.DataFrame(rows, columns=source_cols, dtype=object)
+                promax = pd.to_numeric(df_sheet[COLUMN_MAP['PROMAX']], errors='coerce')
+                week_ending_raw = df_sheet[COLUMN_MAP['Weekly Reference Logged Date']]
+                week_ending = parse_date_column(week_ending_raw)
+                has_promax = promax > 0
+                has_past_date = week_ending < current_week_start
+                mask = has_promax & has_past_date
                 
                 # Track statistics
-                has_promax = promax_val is not None
-                if has_promax:
-                    try:
-                        has_promax = float(promax_val) > 0
-                        if has_promax:
-                            rows_with_promax += 1
-                    except:
-                        has_promax = False
+                rows_with_promax += int(has_promax.sum())
+                rows_with_past_dates += int(has_past_date.sum())
+                sheet_bad_dates = int((week_ending.isna() & week_ending_raw.notna() & (week_ending_raw != '')).sum())
+                rows_with_bad_dates += sheet_bad_dates
+                if sheet_bad_dates:
+                    print(f"    ⚠️  {sheet['name']}: {sheet_bad_dates} rows have an unparseable Weekly Reference Logged Date")
+                sheet_records = int(mask.sum())
+                rows_meeting_criteria += sheet_records
                 
-                has_past_date = is_past_week(week_ending)
-                if has_past_date:
-                    rows_with_past_dates += 1
+                # Rename to destination columns using mapping
+                sheet_df = df_sheet.loc[mask].rename(columns=dest_by_source)
                 
-                if not promax_val or not has_past_date:
-                    continue
-                    
-                try:
-                    if float(promax_val) == 0:
-                        continue
-                except Exception:
-                    continue
-                
-                # Build output row using mapping
-                out_row = {}
-                for dest_col, src_col in COLUMN_MAP.items():
-                    out_row[dest_col] = row.get(src_col, '') if src_col else ''
-                records.append(out_row)
-                sheet_records += 1
-                rows_meeting_criteria += 1
-            
-            print(f"    {sheet['name']}: {sheet_records} records meeting criteria")
+                # Drop rows whose key is already in the archive before they reach consolidation
+                in_archive = pd.MultiIndex.from_frame(sheet_df[effective_key_cols]).isin(archive_index)
+                sheet_archived = int(in_archive.sum())
+                rows_already_archived += sheet_archived
+                frames.append(sheet_df.loc[~in_archive])
+                print(f"    {sheet['name']}: {sheet_records} records meeting criteria ({sheet_archived} already archived)")
             
-        except Exception as e:
-            print(f"    ❌ ERROR processing {sheet['name']}: {e}")
-            continue
+            except Exception as e:
+                print(f"    ❌ ERROR processing {sheet['name']}: {e}")
+                continue
 
     print(f"\n📊 DATA FILTERING SUMMARY:")
     print(f"  Total rows processed: {total_rows_processed}")
     print(f"  Rows with PROMAX > 0: {rows_with_promax}")
     print(f"  Rows with past week dates: {rows_with_past_dates}")
+    print(f"  Rows with unparseable dates (skipped): {rows_with_bad_dates}")
     print(f"  Rows meeting both criteria: {rows_meeting_criteria}")
+    print(f"  Rows already in archive: {rows_already_archived}")
 
-    df = pd.DataFrame(records)
-    if df.empty:
+    if not frames or rows_meeting_criteria == 0:
         print('\n❌ No records meet the criteria.')
         return
+    if rows_meeting_criteria == rows_already_archived:
+        print('\n✅ No new foreman/job combinations to add.')
+        return
+    
+    df = pd.concat(frames, ignore_index=True)
+    # Unmapped destination columns are left blank; empty cells become None
+    df = df.reindex(columns=list(COLUMN_MAP.keys()), fill_value='')
+    df = df.astype(object).where(df.notna(), None)
 
     # Show sample data
-    print(f"\n📋 SAMPLE OF {len(records)} RECORDS:")
+    print(f"\n📋 SAMPLE OF {len(df)} RECORDS:")
     print(df.head().to_string())
     
     print(f"\n📊 COLUMN STATISTICS:")
@@ -284,129 +452,89 @@ def main():
     print("Logic: Consolidate all line items into one summary record per [Job Number + Foreman + Work Release]")
     print("Each group will sum PROMAX values and use most recent dates")
     
-    unique_key_cols = ['Job Number', 'Foreman', 'Work Release']
     print(f"Grouping criteria: {unique_key_cols}")
     
-    # Group records by the unique combination
-    grouped_records = {}
-    for _, rec in df.iterrows():
-        key = tuple(rec.get(col, None) for col in unique_key_cols)
-        if key not in grouped_records:
-            grouped_records[key] = []
-        grouped_records[key].append(rec)
+    if not df.duplicated(subset=unique_key_cols).any():
+        # Every line item is already its own group, so there is nothing to consolidate
+        print("Grouping keys are already unique - skipping consolidation")
+        consolidated_df = df.assign(PROMAX=pd.to_numeric(df['PROMAX'], errors='coerce').fillna(0))
+    else:
+        # Sum PROMAX per group and take the other fields from the group's most recent record
+        grouped = df.assign(
+            _promax=pd.to_numeric(df['PROMAX'], errors='coerce').fillna(0),
+            _logged=parse_date_column(df['Weekly Reference Logged Date']),
+        ).groupby(unique_key_cols, sort=False, dropna=False)
+        latest_idx = grouped['_logged'].idxmax()
+        total_promax = grouped['_promax'].sum()
+        consolidated_df = df.loc[latest_idx.values].assign(PROMAX=total_promax.values).reset_index(drop=True)
     
     print(f"\n📊 GROUPING ANALYSIS:")
-    print(f"  Found {len(grouped_records)} unique job/foreman combinations")
-    print(f"  Consolidating {len(records)} individual line items into {len(grouped_records)} summary records")
-    
-    # Create consolidated records
-    consolidated_records = []
-    for key, group_records in grouped_records.items():
-        job_num, foreman, work_release = key
-        
-        # Sum up all PROMAX values for this group
-        total_promax = sum(float(r.get('PROMAX', 0)) for r in group_records if r.get('PROMAX'))
-        
-        # Use the most recent dates and other fields from the last record
-        latest_record = max(group_records, key=lambda x: x.get('Weekly Reference Logged Date', ''))
-        
-        # Create consolidated record
-        consolidated_record = {
-            'PROMAX': total_promax,
-            'Job Number': job_num,
-            'Foreman': foreman,
-            'Work Release': work_release,
-            'Work Order': latest_record.get('Work Order', ''),
-            'Start Date': latest_record.get('Start Date', ''),
-            'Scope Number': latest_record.get('Scope Number', ''),
-            'Location': latest_record.get('Location', ''),
-            'Crew': latest_record.get('Crew', ''),
-            '% of Completion': latest_record.get('% of Completion', ''),
-            'Weekly Reference Logged Date': latest_record.get('Weekly Reference Logged Date', ''),
-            'Expected Time of Completion': latest_record.get('Expected Time of Completion', ''),
-            'Snapshot Date': latest_record.get('Snapshot Date', ''),
-            'Work Request #': latest_record.get('Work Request #', '')
-        }
-        
-        consolidated_records.append(consolidated_record)
+    print(f"  Found {len(consolidated_df)} unique job/foreman combinations")
+    print(f"  Consolidating {len(df)} individual line items into {len(consolidated_df)} summary records")
     
     # Show sample of consolidated data
-    print(f"\n📋 SAMPLE OF {len(consolidated_records)} CONSOLIDATED RECORDS:")
-    for i, rec in enumerate(consolidated_records[:5]):
+    print(f"\n📋 SAMPLE OF {len(consolidated_df)} CONSOLIDATED RECORDS:")
+    for i, rec in enumerate(consolidated_df.head(5).to_dict('records')):
         print(f"  Group {i+1}: Job {rec['Job Number']} + {rec['Foreman']} = ${rec['PROMAX']:,.2f}")
     
-    if len(consolidated_records) > 5:
-        print(f"    ... and {len(consolidated_records)-5} more groups")
+    if len(consolidated_df) > 5:
+        print(f"    ... and {len(consolidated_df)-5} more groups")
     
     # Show top 5 by revenue
-    sorted_by_revenue = sorted(consolidated_records, key=lambda x: x['PROMAX'], reverse=True)
+    top_by_revenue = consolidated_df.nlargest(5, 'PROMAX').to_dict('records')
     print(f"\n💰 TOP 5 BY REVENUE:")
-    for i, rec in enumerate(sorted_by_revenue[:5]):
+    for i, rec in enumerate(top_by_revenue):
         print(f"  #{i+1}: Job {rec['Job Number']} + {rec['Foreman']} = ${rec['PROMAX']:,.2f}")
     
     # Check against archive for duplicates
     print('\n=== STEP 4: CHECKING CONSOLIDATED RECORDS AGAINST ARCHIVE ===')
     
+    # Rows were already screened in Step 2; this is a final check on the consolidated keys
     try:
-        archive_keys, effective_key_cols = get_archive_existing_keys(ss_client, ARCHIVE_SHEET_ID, unique_key_cols)
-        
-        new_consolidated_rows = []
-        existing_transitions = 0
-        
-        for rec in consolidated_records:
-            key = tuple(rec.get(col, None) for col in effective_key_cols)
-            if key not in archive_keys:
-                new_consolidated_rows.append(rec)
-            else:
-                existing_transitions += 1
+        consolidated_index = pd.MultiIndex.from_frame(consolidated_df[effective_key_cols])
+        new_mask = ~consolidated_index.isin(archive_index)
+        new_df = consolidated_df.loc[new_mask]
+        existing_transitions = len(consolidated_df) - len(new_df)
         
         print(f"\n📈 CONSOLIDATION RESULTS:")
-        print(f"  Existing job/foreman combinations in archive: {len(archive_keys)}")
-        print(f"  New job/foreman combinations to add: {len(new_consolidated_rows)}")
+        print(f"  Existing job/foreman combinations in archive: {len(archive_index)}")
+        print(f"  New job/foreman combinations to add: {len(new_df)}")
         print(f"  Combinations that already exist: {existing_transitions}")
         
-        if new_consolidated_rows:
+        if not new_df.empty:
             print(f"\n📋 NEW CONSOLIDATED RECORDS TO ADD:")
-            for i, rec in enumerate(new_consolidated_rows[:5]):
+            for i, rec in enumerate(new_df.head(5).to_dict('records')):
                 print(f"  Record {i+1}: Job {rec['Job Number']} + {rec['Foreman']} = ${rec['PROMAX']:,.2f}")
-            if len(new_consolidated_rows) > 5:
-                print(f"    ... and {len(new_consolidated_rows)-5} more records")
-            
-            # Update the records list to use consolidated data
-            records = new_consolidated_rows
-            new_rows = new_consolidated_rows
+            if len(new_df) > 5:
+                print(f"    ... and {len(new_df)-5} more records")
     
     except Exception as e:
         print(f"❌ ERROR checking archive: {e}")
         # Proceed with all consolidated records if archive check fails
-        new_rows = consolidated_records
-        effective_key_cols = unique_key_cols
-        print(f"⚠️  Proceeding with all {len(consolidated_records)} consolidated records")
+        new_df = consolidated_df
+        print(f"⚠️  Proceeding with all {len(consolidated_df)} consolidated records")
 
-    if not new_rows:
+    if new_df.empty:
         print('\n✅ No new foreman/job combinations to add.')
         return
 
     # 5. Append to archive master sheet
     print(f'\n=== STEP 5: ARCHIVE OPERATION ===')
     if DRY_RUN:
-        print(f"🔍 DRY RUN: Would append {len(new_rows)} consolidated records to archive")
+        print(f"🔍 DRY RUN: Would append {len(new_df)} consolidated records to archive")
         print("📋 Consolidated records that would be added:")
-        for i, rec in enumerate(new_rows[:5]):  # Show first 5
-            print(f"  Record {i+1}:")
-            print(f"    Job Number: {rec.get('Job Number')}")
-            print(f"    Foreman: {rec.get('Foreman')}")
-            print(f"    PROMAX (Total): ${rec.get('PROMAX'):,.2f}")
-            print(f"    Work Release: {rec.get('Work Release')}")
-            print(f"    Weekly Reference Logged Date: {rec.get('Weekly Reference Logged Date')}")
-            print()
-        if len(new_rows) > 5:
-            print(f"    ... and {len(new_rows)-5} more consolidated records")
+        # Show first 5 as JSON
+        print(orjson.dumps(new_df.head(5).to_dict('records'), option=orjson.OPT_INDENT_2).decode())
+        if len(new_df) > 5:
+            print(f"    ... and {len(new_df)-5} more consolidated records")
     else:
-        print(f"🔄 PRODUCTION MODE: Appending {len(new_rows)} consolidated records to archive...")
+        print(f"🔄 PRODUCTION MODE: Appending {len(new_df)} consolidated records to archive...")
         try:
-            archive_sheet = ss_client.Sheets.get_sheet(ARCHIVE_SHEET_ID)
-            col_map = {col.title: col.id for col in archive_sheet.columns}
+            # Reuse the archive column map from Step 4; only refetch the schema if that failed
+            col_map = archive_col_map
+            if not col_map:
+                archive_cols = with_retry(ss_client.Sheets.get_columns, ARCHIVE_SHEET_ID, include_all=True).data
+                col_map = {col.title: col.id for col in archive_cols}
             
             # Map destination columns to actual archive column names
             archive_col_mapping = {
@@ -417,7 +545,7 @@ def main():
             # Check if all required columns exist in archive (with mapping)
             missing_cols = []
             for col in COLUMN_MAP.keys():
-                if col in new_rows[0]:  # Only check columns that have data
+                if col in new_df.columns:  # Only check columns that have data
                     archive_col_name = archive_col_mapping.get(col, col)
                     if archive_col_name not in col_map:
                         missing_cols.append(f"{col} (looking for '{archive_col_name}')")
@@ -425,18 +553,60 @@ def main():
             if missing_cols:
                 print(f"⚠️  WARNING: Archive sheet missing columns: {missing_cols}")
             
+            # Resolve the archive column id for each output column once, not per cell
+            cols_out = [col for col in new_df.columns if archive_col_mapping.get(col, col) in col_map]
+            col_ids = [col_map[archive_col_mapping.get(col, col)] for col in cols_out]
+            
             new_sheet_rows = []
-            for rec in new_rows:
-                cells = []
-                for col, val in rec.items():
-                    if val:  # Only add non-empty values
-                        archive_col_name = archive_col_mapping.get(col, col)
-                        if archive_col_name in col_map:
-                            cells.append({'column_id': col_map[archive_col_name], 'value': val})
-                new_sheet_rows.append(smartsheet.models.Row(cells=cells, to_bottom=True))
+            # itertuples(name=None) yields plain tuples instead of boxing each row into a Series.
+            # Rows are sent as raw JSON dicts (camelCase API field names), which the SDK passes
+            # through as-is, rather than building smartsheet.models.Row objects.
+            for rec in new_df[cols_out].itertuples(index=False, name=None):
+                # Only add non-empty values
+                cells = [{'columnId': col_id, 'value': val} for col_id, val in zip(col_ids, rec) if val]
+                new_sheet_rows.append({'cells': cells, 'toBottom': True})
             
-            response = ss_client.Sheets.add_rows(ARCHIVE_SHEET_ID, new_sheet_rows)
-            print(f"✅ Successfully added {len(response.data)} consolidated rows to the archive.")
+            # Send rows in chunks with partial success so one bad row doesn't fail the whole batch.
+            # Smartsheet serializes writes to a sheet, so chunks go one after another; this also
+            # keeps the archive rows in order.
+            added_count = 0
+            failed_count = 0
+            chunk_versions = []
+            for offset in range(0, len(new_sheet_rows), ADD_ROWS_CHUNK_SIZE):
+                chunk = new_sheet_rows[offset:offset + ADD_ROWS_CHUNK_SIZE]
+                try:
+                    response = with_retry(ss_client.Sheets.add_rows_with_partial_success, ARCHIVE_SHEET_ID, chunk)
+                    failed_items = response.failed_items or []
+                    added_count += len(response.data)
+                    chunk_versions.append(response.version)
+                    for failure in failed_items:
+                        failed_count += 1
+                        print(f"    ⚠️  Row {offset + failure.index + 1} of {len(new_sheet_rows)} failed: {failure.error}")
+                    if len(response.data) + len(failed_items) != len(chunk):
+                        print(f"    ⚠️  Sent rows {offset + 1}-{offset + len(chunk)} but the API reported "
+                              f"{len(response.data)} added and {len(failed_items)} failed")
+                except Exception as e:
+                    failed_count += len(chunk)
+                    print(f"    ❌ ERROR adding rows {offset + 1}-{offset + len(chunk)}: {e}")
+            
+            print(f"✅ Successfully added {added_count} consolidated rows to the archive.")
+            if failed_count:
+                print(f"⚠️  {failed_count} rows could not be added.")
+            
+            # Fold the appended keys into the cached index, tagged with the post-append sheet
+            # version, so the next run can reuse it instead of re-reading the whole archive.
+            # Each add_rows call bumps the version by one, so the chunk versions must follow on
+            # from the version the keys were read at; a gap means someone else changed the
+            # archive during this run and the cached keys no longer match the sheet.
+            versions_contiguous = (archive_keys_loaded and chunk_versions and None not in chunk_versions
+                                   and sorted(chunk_versions) == list(range(archive_version + 1,
+                                                                            archive_version + 1 + len(chunk_versions))))
+            if failed_count == 0 and versions_contiguous:
+                appended_keys = pd.MultiIndex.from_frame(new_df[effective_key_cols])
+                archive_index = archive_index.append(appended_keys).unique()
+                save_archive_key_cache(ARCHIVE_SHEET_ID, max(chunk_versions), effective_key_cols, archive_index)
+            else:
+                clear_archive_key_cache()
             
         except Exception as e:
             print(f"❌ ERROR adding rows to archive: {e}")
@@ -444,4 +614,8 @@ def main():
     print(f"\n🎉 Process completed!")
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Consolidate UPR source sheets into the archive master sheet.")
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help="Ignore the local archive key cache and re-read the archive sheet")
+    args = parser.parse_args()
+    main(refresh_cache=args.refresh_cache)